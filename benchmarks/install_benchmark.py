@@ -0,0 +1,328 @@
+#!/usr/bin/env python
+#
+# Copyright (c) 2016 Nutanix Inc. All rights reserved.
+#
+# This script runs full NGT installs against a throwaway root folder and
+# reports the time spent in each install phase as json. System tools that
+# would modify the VM (dracut, chkconfig, update-rc.d, systemctl, the init
+# script) are replaced with stubs that optionally sleep to model their cost.
+#
+# Usage:
+# "python benchmarks/install_benchmark.py --distro redhat --iterations 5
+#    --kernels 3 --dracut-secs 1 --output results.json"
+#
+# The dracut stub writes the modules listed in the add_drivers line of
+# dracut.conf into the image it builds and the lsinitrd stub prints them back,
+# so the first iteration rebuilds the initramfs of every fake kernel and later
+# iterations find them up to date. With --drivers-present the images start
+# out up to date. --dracut-conf-drivers seeds the add_drivers line, e.g. with
+# "e1000e" to check that similarly named drivers are still added.
+#
+# The script exits with status 1 if any initramfs image ends up in the failed
+# state.
+#
+# The script must be run as root since the installer changes the ownership
+# of the installed files.
+#
+
+import json
+import logging
+import optparse
+import os
+import shutil
+import stat
+import sys
+import tempfile
+
+src_path = os.path.abspath(
+  os.path.join(os.path.dirname(__file__), os.pardir, "src"))
+sys.path.insert(0, src_path)
+
+import installer_utils
+
+from installer_utils import get_install_profiler
+
+# Stubbed commands and the option that holds the seconds each stub sleeps.
+STUB_COMMANDS = {
+  "dracut": "dracut_secs",
+  "lsinitrd": None,
+  "modinfo": None,
+  "chkconfig": "service_secs",
+  "update-rc.d": "service_secs",
+  "systemctl": "service_secs",
+  "ngt_guest_agent": "service_secs",
+}
+
+# Folder of the module files reported by the modinfo stub.
+STUB_MODULE_DIR = "/lib/modules/stub/kernel/drivers"
+
+# Commands that replace the bodies of the stubs. modinfo is called with the
+# module name as the last argument, dracut as "dracut -f <image> <kernel>" and
+# lsinitrd as "lsinitrd <image>". @DRACUT_CONF@ is replaced with the path of
+# the throwaway dracut.conf.
+STUB_BODIES = {
+  "modinfo": 'for module; do :; done; echo "%s/$module.ko"' % STUB_MODULE_DIR,
+  "dracut": 'sed -n \'s/^add_drivers+="\\(.*\\)"$/\\1/p\' @DRACUT_CONF@ | '
+            'tr " " "\\n" | sed -n \'s|^\\(..*\\)$|%s/\\1.ko|p\' > "$2"'
+            % STUB_MODULE_DIR,
+  "lsinitrd": 'cat "$1"',
+}
+
+# Phases of install_ngt.py in the order they are run.
+INSTALL_STEPS = ["check_installation_required", "do_cleanup", "do_validate",
+                 "do_pre_process", "do_setup", "do_post_process"]
+
+def get_installer_class(distro):
+  """
+  Returns the installer class for the given distribution family.
+  """
+  if distro == "redhat":
+    from redhat_installer import RedhatInstaller
+    return RedhatInstaller
+  if distro == "ubuntu":
+    from ubuntu_installer import UbuntuInstaller
+    return UbuntuInstaller
+  if distro == "suse":
+    from suse_installer import SuseInstaller
+    return SuseInstaller
+  raise Exception("Unsupported distribution %s" % distro)
+
+def write_stub(path, sleep_secs, output="", body=""):
+  """
+  Writes an executable shell stub that sleeps for 'sleep_secs', prints
+  'output' and runs the shell commands in 'body'.
+  """
+  with open(path, "w") as stub_file:
+    stub_file.write("#!/bin/sh\n")
+    if sleep_secs:
+      stub_file.write("sleep %s\n" % sleep_secs)
+    if output:
+      stub_file.write("echo '%s'\n" % output)
+    if body:
+      stub_file.write(body + "\n")
+    stub_file.write("exit 0\n")
+  os.chmod(path, os.stat(path).st_mode | stat.S_IEXEC)
+
+def make_root(options):
+  """
+  Creates the throwaway root folder with the stubbed commands, fake kernels,
+  dracut.conf and installer config. Returns the root folder path.
+  """
+  root = tempfile.mkdtemp(prefix="ngt_install_benchmark_")
+  stub_dir = os.path.join(root, "stubs")
+  for path in [stub_dir, root + "/etc/init.d", root + "/etc/systemd/system",
+               root + "/boot", root + "/lib/modules", root + "/iso/config",
+               root + "/usr/local"]:
+    os.makedirs(path)
+
+  for command, sleep_option in STUB_COMMANDS.items():
+    sleep_secs = 0
+    if sleep_option:
+      sleep_secs = getattr(options, sleep_option)
+    body = STUB_BODIES.get(command, "").replace("@DRACUT_CONF@",
+                                                root + "/etc/dracut.conf")
+    write_stub(os.path.join(stub_dir, command), sleep_secs, body=body)
+
+  kernels = [os.uname()[2]]
+  for index in range(options.kernels):
+    kernel = "stub-kernel-%d" % index
+    kernels.append(kernel)
+    os.makedirs(root + "/lib/modules/" + kernel)
+    open(root + "/boot/vmlinuz-" + kernel, "w").close()
+
+  # The running kernel is always set up by the installer, so its image is
+  # created along with those of the fake kernels.
+  if options.drivers_present:
+    from redhat_installer import RedhatInstaller
+    for kernel in kernels:
+      with open(root + "/boot/initramfs-" + kernel + ".img", "w") as image:
+        for driver in RedhatInstaller.MOBILITY_DRIVERS:
+          image.write("%s/%s.ko\n" % (STUB_MODULE_DIR, driver))
+
+  with open(root + "/etc/dracut.conf", "w") as dracut_conf:
+    if options.dracut_conf_drivers:
+      dracut_conf.write('add_drivers+=" %s "\n' % options.dracut_conf_drivers)
+    else:
+      dracut_conf.write('#add_drivers+=""\n')
+
+  with open(root + "/iso/config/ngt_config.json", "w") as config_file:
+    json.dump({"ngt_version": "benchmark"}, config_file)
+  return root
+
+def rebase_installer(installer_class, root):
+  """
+  Returns a subclass of 'installer_class' whose destination paths are all
+  inside 'root'.
+  """
+  ngt_root = root + "/usr/local/nutanix"
+  ngt_config = ngt_root + "/config"
+  attributes = {
+    "NGT_SRC_CONFIG": root + "/iso/config",
+    "NGT_ROOT": ngt_root,
+    "NGT_CONFIG": ngt_config,
+    "NGT_LOGS": ngt_root + "/logs",
+    "NGT_BIN": ngt_root + "/bin",
+    "NGT_LIB": ngt_root + "/lib",
+    "DAEMON_CONFIG_DIR": root + "/etc/init.d",
+    "NGT_DST_PACKAGE_PATH": ngt_root + "/" + installer_class.NGT_PACKAGE_NAME,
+    "NGT_DST_DAEMON_PATH": root + "/etc/init.d/" +
+                           installer_class.NGT_DAEMON_NAME,
+    "NGT_MARKER_PATH": ngt_config + "/" + installer_class.NGT_MARKER_NAME,
+    "SYSTEMD_RUNTIME_DIR": root + "/run/systemd/system",
+    "SYSTEMD_UNIT_DIR": root + "/etc/systemd/system",
+    "NGT_DST_SYSTEMD_UNIT_PATH": root + "/etc/systemd/system/" +
+                                 installer_class.NGT_SYSTEMD_UNIT_NAME,
+    "NGT_DRACUT_PATH": root + "/etc/dracut.conf",
+    "KERNEL_MODULES_DIR": root + "/lib/modules",
+    "BOOT_DIR": root + "/boot",
+    "NGT_MOBILITY_DRIVERS_STATUS_PATH": ngt_config +
+                                        "/mobility_drivers_status.json",
+  }
+  # Skip the root and dmidecode checks of the base class.
+  attributes["do_validate"] = lambda self: True
+  return type("Benchmark" + installer_class.__name__, (installer_class,),
+              attributes)
+
+def stub_shell_commands(root):
+  """
+  Redirects the commands run by the installer modules to the stubs in 'root'.
+  Commands without a stub are run unchanged.
+  """
+  stub_dir = os.path.join(root, "stubs")
+  real_run_shell_command = installer_utils.run_shell_command
+
+  def run_stubbed_shell_command(argsList):
+    stub_path = os.path.join(stub_dir, os.path.basename(argsList[0]))
+    if os.path.exists(stub_path):
+      argsList = [stub_path] + list(argsList[1:])
+    return real_run_shell_command(argsList)
+
+  for module in sys.modules.values():
+    if getattr(module, "run_shell_command", None) is real_run_shell_command:
+      module.run_shell_command = run_stubbed_shell_command
+
+def run_install(installer):
+  """
+  Runs the steps of install_ngt.py with 'installer' and returns the profile
+  report.
+  """
+  profiler = get_install_profiler()
+  profiler.reset()
+  for step in INSTALL_STEPS:
+    with profiler.phase(step):
+      getattr(installer, step)()
+  report = profiler.report()
+  report["initramfs_status"] = getattr(installer, "initramfs_status", {})
+
+  # The modinfo stub reports every mobility driver as available, so every
+  # image must end up with all of them.
+  report["initramfs_missing_drivers"] = {}
+  for kernel, status in report["initramfs_status"].items():
+    contents = ""
+    if os.path.exists(status["initramfs"]):
+      with open(status["initramfs"]) as image:
+        contents = image.read()
+    missing_drivers = [
+      driver for driver in installer.MOBILITY_DRIVERS
+      if "%s/%s.ko" % (STUB_MODULE_DIR, driver) not in contents.split()]
+    if missing_drivers:
+      report["initramfs_missing_drivers"][kernel] = missing_drivers
+  return report
+
+def get_failed_initramfs(reports):
+  """
+  Returns the (iteration, kernel, missing drivers) of every initramfs image
+  left in the failed state or without all of the mobility drivers.
+  """
+  failed = []
+  for iteration, report in enumerate(reports):
+    for kernel, status in report["initramfs_status"].items():
+      missing_drivers = report["initramfs_missing_drivers"].get(kernel, [])
+      if status["state"] == "failed" or missing_drivers:
+        failed.append((iteration, kernel,
+                       missing_drivers or status["missing_drivers"]))
+  return failed
+
+def summarize(reports):
+  """
+  Returns the min, median and max duration of each top level phase across
+  the given reports.
+  """
+  durations = {}
+  for report in reports:
+    for phase in report["phases"]:
+      durations.setdefault(phase["name"], []).append(phase["duration_secs"])
+    durations.setdefault("total", []).append(report["total_secs"])
+
+  summary = {}
+  for name, values in durations.items():
+    values.sort()
+    summary[name] = {"min_secs": values[0],
+                     "median_secs": values[len(values) // 2],
+                     "max_secs": values[-1]}
+  return summary
+
+def main():
+  parser = optparse.OptionParser()
+  parser.add_option("--distro", default="redhat",
+                    help="Installer to benchmark: redhat, ubuntu or suse.")
+  parser.add_option("--iterations", type="int", default=3,
+                    help="Number of full installs to run.")
+  parser.add_option("--kernels", type="int", default=2,
+                    help="Number of fake installed kernels.")
+  parser.add_option("--drivers-present", action="store_true", default=False,
+                    help="Start with initramfs images that already contain "
+                         "the mobility drivers.")
+  parser.add_option("--dracut-conf-drivers", default="",
+                    help="Drivers already listed in the add_drivers line of "
+                         "dracut.conf, e.g. \"e1000e\".")
+  parser.add_option("--dracut-secs", type="float", default=0,
+                    help="Seconds each stubbed dracut run takes.")
+  parser.add_option("--service-secs", type="float", default=0,
+                    help="Seconds each stubbed service command takes.")
+  parser.add_option("--output", default=None,
+                    help="File to write the json results to. Defaults to "
+                         "stdout.")
+  (options, args) = parser.parse_args()
+
+  # Installer errors such as "already installed" are expected when the same
+  # root is reinstalled, only report failures.
+  logging.basicConfig(level=logging.CRITICAL)
+  root = make_root(options)
+  try:
+    # The installer modules must be imported before their commands are
+    # redirected to the stubs.
+    installer_class = rebase_installer(get_installer_class(options.distro),
+                                       root)
+    stub_shell_commands(root)
+    reports = []
+    for _ in range(options.iterations):
+      reports.append(run_install(installer_class()))
+  finally:
+    shutil.rmtree(root, ignore_errors=True)
+
+  results = {"distro": options.distro,
+             "iterations": options.iterations,
+             "kernels": options.kernels,
+             "drivers_present": options.drivers_present,
+             "dracut_conf_drivers": options.dracut_conf_drivers,
+             "dracut_secs": options.dracut_secs,
+             "service_secs": options.service_secs,
+             "summary": summarize(reports),
+             "runs": reports}
+  if options.output:
+    with open(options.output, "w") as output_file:
+      json.dump(results, output_file, indent=2, sort_keys=True)
+  else:
+    print(json.dumps(results, indent=2, sort_keys=True))
+
+  failed = get_failed_initramfs(reports)
+  for iteration, kernel, missing_drivers in failed:
+    sys.stderr.write("Iteration %d: initramfs for kernel %s is missing "
+                     "drivers : %s\n"
+                     % (iteration, kernel, " ".join(missing_drivers)))
+  if failed:
+    sys.exit(1)
+
+if __name__ == "__main__":
+  main()
@@ -20,10 +20,14 @@
 #
 # Usage:
 # "python install_ngt.py" - Install NGT Guest Agent & mobility drivers.
+# "python install_ngt.py --defer-initramfs-rebuild" - Install NGT Guest Agent
+#   and rebuild the initramfs for the mobility drivers in the background once
+#   the agent is running.
 #
 
 import datetime
 import logging
+import optparse
 import os
 import sys
 import time
@@ -38,14 +42,17 @@ sys.path.insert(0, src_path)
 
 from installer_factory import *
 
-def install_ngt():
+def install_ngt(defer_initramfs_rebuild=False):
   """
   Install the NGT Guest Agent and mobility drivers. Cleanup any stale state
-  left behind from a previous install.
+  left behind from a previous install. If 'defer_initramfs_rebuild' is set,
+  the initramfs is rebuilt in the background after the agent is started.
+  The time spent in each install phase is written to a json report next to
+  the install log.
   """
 
-  logfilename = "/tmp/ngt_install_log_" +\
-    datetime.datetime.now().strftime("%Y%m%d%H%M%S") + ".txt"
+  timestamp = datetime.datetime.now().strftime("%Y%m%d%H%M%S")
+  logfilename = "/tmp/ngt_install_log_" + timestamp + ".txt"
   logging.basicConfig(filename=logfilename, level=logging.NOTSET, format=\
     '[%(asctime)s] {%(filename)s:%(lineno)d} %(levelname)s - %(message)s',
     datefmt='%Y-%m-%d %H:%M:%S')
@@ -53,45 +60,73 @@ def install_ngt():
   consoleHandler = logging.StreamHandler()
   logger.addHandler(consoleHandler)
 
+  profiler = get_install_profiler()
+  profile_filename = "/tmp/ngt_install_profile_" + timestamp + ".json"
+  logging.info("Recording install phase timings in %s" % profile_filename)
+  try:
+    run_install_steps(defer_initramfs_rebuild)
+  finally:
+    try:
+      profiler.write_report(profile_filename)
+    except:
+      pass
+
+def run_install_steps(defer_initramfs_rebuild):
+  """
+  Runs the install steps of install_ngt() and records the time spent in each
+  of them.
+  """
+  profiler = get_install_profiler()
+
   # Fetch the appropriate installer for the current distribution.
   linux_installer = get_linux_installer()
+  linux_installer.defer_driver_setup = defer_initramfs_rebuild
 
   # Check if NGT is already installed.
   is_ngt_installed = linux_installer.is_ngt_installed()
 
   # Check if NGT installation is required.
   if is_ngt_installed:
-    is_installation_required = linux_installer.check_installation_required()
+    with profiler.phase("check_installation_required"):
+      is_installation_required = \
+        linux_installer.check_installation_required()
     if not is_installation_required:
       exit_installer(1)
       return
 
   # Clean up a previous installation or any partial state on each run.
-  linux_installer.do_cleanup()
+  with profiler.phase("do_cleanup"):
+    linux_installer.do_cleanup()
 
   # Check if the conditions required for execution are met. No need to
   # cleanup if validation fails since no changes have been made yet.
-  if not linux_installer.do_validate():
+  with profiler.phase("do_validate"):
+    is_valid = linux_installer.do_validate()
+  if not is_valid:
     exit_installer(1)
     return
   try:
     # Set up the folder structure required for the NGT Guest Agent setup.
-    linux_installer.do_pre_process()
+    with profiler.phase("do_pre_process"):
+      linux_installer.do_pre_process()
 
     # Install the NGT Guest Agent & Set up the VM Mobility drivers.
-    linux_installer.do_setup()
+    with profiler.phase("do_setup"):
+      linux_installer.do_setup()
 
     # Clean up any temporary state & start the NGT Guest Agent daemon.
-    linux_installer.do_post_process()
+    with profiler.phase("do_post_process"):
+      linux_installer.do_post_process()
 
     retry_count = NGT_START_RETRY_COUNT
     nga_service_running = False
-    for _ in range(retry_count):
-      logging.info("Waiting for Nutanix Guest Agent Service to start...")
-      time.sleep(NGT_START_WAIT_INTERVAL)
-      if linux_installer.is_ngt_running():
-        nga_service_running = True
-        break
+    with profiler.phase("wait_for_ngt_start"):
+      for _ in range(retry_count):
+        logging.info("Waiting for Nutanix Guest Agent Service to start...")
+        time.sleep(NGT_START_WAIT_INTERVAL)
+        if linux_installer.is_ngt_running():
+          nga_service_running = True
+          break
 
     if nga_service_running:
       logging.info("Nutanix Guest Agent Service successfully started in " +
@@ -108,7 +143,17 @@ def install_ngt():
     exit_installer(1)
     return
 
+  # Run the setup steps deferred until the agent is running.
+  with profiler.phase("do_deferred_setup"):
+    linux_installer.do_deferred_setup()
+
 if __name__ == "__main__":
+  parser = optparse.OptionParser()
+  parser.add_option("--defer-initramfs-rebuild", action="store_true",
+                    dest="defer_initramfs_rebuild", default=False,
+                    help="Rebuild the initramfs for the VM mobility drivers "
+                         "in the background after the agent is started.")
+  (options, args) = parser.parse_args()
 
   # Check if python2.6 or python2.7 is installed or not.
   version = sys.version_info
@@ -125,4 +170,4 @@ if __name__ == "__main__":
                       "NGT cannot be installed on this host.")
         exit_installer(1)
 
-  install_ngt()
+  install_ngt(options.defer_initramfs_rebuild)
@@ -9,15 +9,16 @@
 # distribution specific implementation.
 #
 
-import json
 import logging
 import os
 import pwd
 import shutil
 import stat
 import tarfile
+import zipfile
 
 from abc import ABCMeta, abstractmethod
+from config_store import atomic_copy, get_config_store
 from distutils.version import LooseVersion
 from installer_utils import *
 
@@ -30,6 +31,7 @@ class LinuxInstaller(object):
   # Component names
   NGT_PACKAGE_NAME = "ngt_guest_agent.tar.gz"
   NGT_DAEMON_NAME = "ngt_guest_agent"
+  NGT_SYSTEMD_UNIT_NAME = NGT_DAEMON_NAME + ".service"
   NGT_UNINSTALL_SCRIPT_NAME = "uninstall_ngt.py"
   NGT_MARKER_NAME = "ngt_marker"
   NGT_LICENCE_FILE = "License.txt"
@@ -42,6 +44,7 @@ class LinuxInstaller(object):
   NGT_SRC_CONFIG = NGT_SRC_ROOT + "/config"
   NGT_SRC_PACKAGE_PATH = NGT_SRC_SOURCE + "/" + NGT_PACKAGE_NAME
   NGT_SRC_DAEMON_PATH = NGT_SRC_SOURCE + "/" + NGT_DAEMON_NAME
+  NGT_SRC_SYSTEMD_UNIT_PATH = NGT_SRC_SOURCE + "/" + NGT_SYSTEMD_UNIT_NAME
   NGT_SRC_UNINSTALL_SCRIPT_PATH = NGT_SRC_LINUX + "/" + NGT_UNINSTALL_SCRIPT_NAME
   NGT_SRC_LICENSE_FILE_PATH = NGT_SRC_LINUX + "/" + NGT_LICENCE_FILE 
 
@@ -50,11 +53,21 @@ class LinuxInstaller(object):
   NGT_CONFIG = NGT_ROOT + "/config"
   NGT_LOGS = NGT_ROOT + "/logs"
   NGT_BIN = NGT_ROOT + "/bin"
+  NGT_LIB = NGT_ROOT + "/lib"
   DAEMON_CONFIG_DIR = "/etc/init.d"
   NGT_DST_PACKAGE_PATH = NGT_ROOT + "/" + NGT_PACKAGE_NAME
   NGT_DST_DAEMON_PATH = DAEMON_CONFIG_DIR + "/" + NGT_DAEMON_NAME
   NGT_MARKER_PATH = NGT_CONFIG + "/" + NGT_MARKER_NAME
 
+  # systemd locations. The runtime folder only exists if systemd is running.
+  SYSTEMD_RUNTIME_DIR = "/run/systemd/system"
+  SYSTEMD_UNIT_DIR = "/etc/systemd/system"
+  NGT_DST_SYSTEMD_UNIT_PATH = SYSTEMD_UNIT_DIR + "/" + NGT_SYSTEMD_UNIT_NAME
+
+  # If set, slow parts of the VM mobility driver setup are left to
+  # do_deferred_setup() which runs once the NGT Guest Agent is started.
+  defer_driver_setup = False
+
   def is_ngt_installed(self):
     """
     This function checks if NGT is already installed.
@@ -70,9 +83,7 @@ class LinuxInstaller(object):
     """
 
     try:
-      with open(file) as data_file:
-        data = json.load(data_file)
-      return data["ngt_version"]
+      return get_config_store(file).get_ngt_version()
     except Exception as e:
       logging.error("Error occured while reading config file %s." %(file))
       return None
@@ -181,6 +192,76 @@ class LinuxInstaller(object):
     This function stops the NGT Guest Agent daemon and removes it.
     """
 
+  def is_systemd_available(self):
+    """
+    This function checks if systemd is the init system of this VM.
+    """
+    return os.path.isdir(self.SYSTEMD_RUNTIME_DIR)
+
+  def install_ngt_systemd_service(self):
+    """
+    This function installs the NGT Guest Agent as a systemd service. The init
+    script is still copied to the bin folder since the service uses it to
+    clean up old iSCSI targets before the agent starts.
+    """
+    logging.info("Installing Nutanix Guest Agent Service as a systemd service.")
+    python = get_agent_python()
+    if not python:
+      raise Exception("Python 2.7/2.6 not found.")
+
+    with open(self.NGT_SRC_SYSTEMD_UNIT_PATH) as unit_file:
+      unit = unit_file.read().replace("@PYTHON@", python)
+    with open(self.NGT_DST_SYSTEMD_UNIT_PATH, "w") as unit_file:
+      unit_file.write(unit)
+
+    shutil.copy(self.NGT_SRC_DAEMON_PATH, self.NGT_BIN)
+
+    try:
+      run_shell_command(["systemctl", "daemon-reload"])
+      run_shell_command(["systemctl", "enable", self.NGT_SYSTEMD_UNIT_NAME])
+    except:
+      logging.error("Failed to enable Nutanix Guest Agent Service.")
+      raise
+
+    logging.info("Successfully installed Nutanix Guest Agent Service.")
+
+  def uninstall_ngt_systemd_service(self):
+    """
+    This function stops the NGT Guest Agent systemd service and removes it.
+    """
+    # Only attempt uninstall if the service was installed.
+    if not os.path.exists(self.NGT_DST_SYSTEMD_UNIT_PATH):
+      return
+
+    # Stop the service if currently running.
+    try:
+      run_shell_command(["systemctl", "stop", self.NGT_SYSTEMD_UNIT_NAME])
+    except:
+      pass
+
+    # Turn the autostart on boot to off.
+    try:
+      run_shell_command(["systemctl", "disable", self.NGT_SYSTEMD_UNIT_NAME])
+    except:
+      pass
+
+    os.remove(self.NGT_DST_SYSTEMD_UNIT_PATH)
+
+    try:
+      run_shell_command(["systemctl", "daemon-reload"])
+    except:
+      pass
+
+  def start_ngt_daemon(self):
+    """
+    This function starts the NGT Guest Agent through the installed service
+    manager.
+    """
+    if os.path.exists(self.NGT_DST_SYSTEMD_UNIT_PATH):
+      run_shell_command(["systemctl", "start", self.NGT_SYSTEMD_UNIT_NAME])
+    else:
+      run_shell_command([self.NGT_DST_DAEMON_PATH, "start"])
+
   @abstractmethod
   def setup_mobility_drivers(self):
     """
@@ -191,35 +272,109 @@ class LinuxInstaller(object):
   def do_setup(self):
     """
     This function installs the NGT Guest Agent on this VM, sets it up as
-    a init.d daemon and sets up the VM mobility drivers for this VM.
+    a systemd service (or an init.d daemon if systemd is not available) and
+    sets up the VM mobility drivers for this VM.
     """
+    profiler = get_install_profiler()
+
     # Setup the VM mobility drivers.
     try:
-      self.setup_mobility_drivers()
+      with profiler.phase("setup_mobility_drivers"):
+        self.setup_mobility_drivers()
     except:
       logging.error("Failed to setup Nutanix Guest Tools - VM mobility "\
         "drivers.")
       raise
 
-    shutil.copy(self.NGT_SRC_PACKAGE_PATH, self.NGT_ROOT)
+    with profiler.phase("extract_package"):
+      shutil.copy(self.NGT_SRC_PACKAGE_PATH, self.NGT_ROOT)
+
+      # Extract the contents of the NGT installer package in the NGT root
+      # folder.
+      tar_file = tarfile.open(self.NGT_DST_PACKAGE_PATH, "r:gz")
+      tar_file.extractall(self.NGT_ROOT)
 
-    # Extract the contents of the NGT installer package in the NGT root folder.
-    tar_file = tarfile.open(self.NGT_DST_PACKAGE_PATH, "r:gz")
-    tar_file.extractall(self.NGT_ROOT)
+    # Precompile the NGT Guest Agent and its third party libraries for the
+    # interpreter that runs it.
+    with profiler.phase("compile_ngt_bytecode"):
+      self.compile_ngt_bytecode()
 
-    config_files = os.listdir(self.NGT_SRC_CONFIG)
-    for file_name in config_files:
-      file_path = os.path.join(self.NGT_SRC_CONFIG, file_name)
-      if (os.path.isfile(file_path)):
-        shutil.copy(file_path, self.NGT_CONFIG)
+    with profiler.phase("copy_config_files"):
+      config_files = os.listdir(self.NGT_SRC_CONFIG)
+      for file_name in config_files:
+        file_path = os.path.join(self.NGT_SRC_CONFIG, file_name)
+        if (os.path.isfile(file_path)):
+          atomic_copy(file_path, self.NGT_CONFIG)
 
     # Install the NGT Guest Agent daemon.
     try:
-      self.install_ngt_daemon()
+      with profiler.phase("install_ngt_daemon"):
+        if self.is_systemd_available():
+          self.install_ngt_systemd_service()
+        else:
+          self.install_ngt_daemon()
     except:
       # raise an exception so that installer does cleanup.
       raise
 
+  def extract_ngt_eggs(self):
+    """
+    This function unpacks the zipped eggs in the NGT lib folder into egg
+    folders of the same name. The zipped eggs ship python 2.6 bytecode which
+    zipimport cannot use with other interpreters, so their modules would be
+    compiled again in memory on every start of the agent. Eggs that cannot
+    be unpacked are left zipped.
+    """
+    if not os.path.isdir(self.NGT_LIB):
+      return
+
+    for file_name in os.listdir(self.NGT_LIB):
+      egg_path = os.path.join(self.NGT_LIB, file_name)
+      if not file_name.endswith(".egg") or not zipfile.is_zipfile(egg_path):
+        continue
+      temp_path = egg_path + ".tmp"
+      try:
+        egg_file = zipfile.ZipFile(egg_path)
+        try:
+          egg_file.extractall(temp_path)
+        finally:
+          egg_file.close()
+        os.remove(egg_path)
+        os.rename(temp_path, egg_path)
+      except Exception as e:
+        logging.warning("Failed to unpack %s : %s" % (egg_path, e))
+        shutil.rmtree(temp_path, ignore_errors=True)
+
+  def compile_ngt_bytecode(self):
+    """
+    This function byte compiles the extracted NGT Guest Agent sources and
+    its unpacked eggs with the interpreter that runs the daemon. Any bytecode
+    shipped in the package is removed first since it may have been built by
+    a different interpreter. The daemon runs as root and would write the
+    bytecode of its own modules on the first start anyway, so precompiling
+    them only saves that first start. The eggs are the part that would
+    otherwise be compiled again on every start. Failure to compile is not
+    fatal as the interpreter falls back to compiling the modules on import.
+    """
+    self.extract_ngt_eggs()
+
+    for root, dirs, files in os.walk(self.NGT_ROOT):
+      for file in files:
+        if file.endswith(".pyc") or file.endswith(".pyo"):
+          os.remove(os.path.join(root, file))
+
+    python = get_agent_python()
+    if not python:
+      logging.warning("Python 2.7/2.6 not found. Skipping precompilation of "\
+        "Nutanix Guest Agent.")
+      return
+
+    try:
+      run_shell_command([python, "-m", "compileall", "-q", "-f",
+                         self.NGT_BIN, self.NGT_ROOT + "/ngt", self.NGT_LIB])
+    except Exception as e:
+      logging.warning("Failed to precompile Nutanix Guest Agent : %s" % e)
+
   def set_file_permissions(self):
     """
     This method sets the permissions on contents of the /usr/local/nutanix folder
@@ -256,15 +411,20 @@ class LinuxInstaller(object):
     starts the NGT Guest Agent daemon and cleans up any temporary state from
     the installation phase.
     """
+    profiler = get_install_profiler()
+
     # Start the NGT Guest Agent daemon.
     try:
-      run_shell_command([self.NGT_DST_DAEMON_PATH, "start"])
+      with profiler.phase("start_ngt_daemon"):
+        self.start_ngt_daemon()
     except:
-      log.error("Failed to start Nutanix Guest Agent Service.")
+      logging.error("Failed to start Nutanix Guest Agent Service.")
       raise
 
-    # Copy installer utils.
+    # Copy installer utils, the shared config store and platform probe.
     shutil.copy(self.NGT_SRC_SOURCE + "/installer_utils.py", self.NGT_BIN)
+    shutil.copy(self.NGT_SRC_SOURCE + "/config_store.py", self.NGT_BIN)
+    shutil.copy(self.NGT_SRC_SOURCE + "/platform_probe.py", self.NGT_BIN)
 
     # Copy the uninstall script from the iso to bin.
     shutil.copy(self.NGT_SRC_UNINSTALL_SCRIPT_PATH, self.NGT_BIN)
@@ -276,18 +436,30 @@ class LinuxInstaller(object):
     if os.path.exists(self.NGT_DST_PACKAGE_PATH):
       os.remove(self.NGT_DST_PACKAGE_PATH)
 
-    self.set_file_permissions()
+    with profiler.phase("set_file_permissions"):
+      self.set_file_permissions()
 
     # Write a marker file to indicate completion of installation steps.
     with open(self.NGT_MARKER_PATH, 'a'):
       os.utime(self.NGT_MARKER_PATH, None)
 
+  def do_deferred_setup(self):
+    """
+    This function runs the setup steps that were deferred until the NGT Guest
+    Agent is running. The base implementation has nothing to defer.
+    """
+    pass
+
   def do_cleanup(self):
     """
     This function uninstalls the NGT Guest Agent daemon and removes any files and
     folders that were created during its setup.
     """
     # Uninstall the NGT Guest Agent daemon.
+    try:
+      self.uninstall_ngt_systemd_service()
+    except:
+      pass
     try:
       self.uninstall_ngt_daemon()
     except:
@@ -0,0 +1,213 @@
+#
+# Copyright (c) 2016 Nutanix Inc. All rights reserved.
+#
+# This module provides a shared store for the NGT json configuration files.
+# Parsed configuration is cached per file and is only re-read when the file
+# is replaced or modified on disk. Writes are atomic so readers never observe
+# a partially written file.
+#
+
+import json
+import logging
+import os
+import shutil
+import tempfile
+import threading
+
+# Stores shared by all callers in this process, keyed by the config file path.
+_config_stores = {}
+_config_stores_lock = threading.Lock()
+
+class ConfigStore(object):
+  """
+  This class caches the parsed contents of a json configuration file and
+  provides typed accessors for the NGT configuration keys.
+  """
+
+  def __init__(self, path):
+    self.path = path
+    self._lock = threading.RLock()
+    self._file_key = None
+    self._data = None
+    self._subscribers = []
+
+  def _get_file_key(self):
+    """
+    Returns the key identifying the current version of the config file. The
+    key changes whenever the file is replaced (inode) or modified (mtime, size).
+    """
+    st = os.stat(self.path)
+    return (st.st_dev, st.st_ino, st.st_mtime, st.st_size)
+
+  def _notify_subscribers(self, data):
+    """
+    Invokes the subscribed callbacks with the new configuration data.
+    """
+    for callback in list(self._subscribers):
+      try:
+        callback(data)
+      except Exception as e:
+        logging.error("Config change callback failed for %s : %s"
+          % (self.path, e))
+
+  def subscribe(self, callback):
+    """
+    Registers 'callback' to be invoked with the parsed configuration every
+    time a change to the config file is observed.
+    """
+    with self._lock:
+      self._subscribers.append(callback)
+
+  def unsubscribe(self, callback):
+    """
+    Removes a callback registered with subscribe().
+    """
+    with self._lock:
+      if callback in self._subscribers:
+        self._subscribers.remove(callback)
+
+  def get(self):
+    """
+    Returns the parsed configuration. The file is only parsed again if it has
+    changed since it was last read. Raises an exception if the file cannot be
+    read or parsed. The returned dict is shared and must not be modified.
+    """
+    with self._lock:
+      file_key = self._get_file_key()
+      if file_key == self._file_key:
+        return self._data
+
+      with open(self.path) as data_file:
+        data = json.load(data_file)
+
+      changed = self._data is not None and data != self._data
+      self._file_key = file_key
+      self._data = data
+      if changed:
+        self._notify_subscribers(data)
+      return data
+
+  def get_value(self, key, default=None):
+    """
+    Returns the value of 'key' from the configuration or 'default' if the key
+    is not present.
+    """
+    return self.get().get(key, default)
+
+  def write(self, data):
+    """
+    Atomically replaces the config file with the json serialization of 'data'.
+    """
+    with self._lock:
+      fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(self.path),
+                                       prefix=".ngt_config_")
+      try:
+        temp_file = os.fdopen(fd, "w")
+        try:
+          json.dump(data, temp_file, indent=2, sort_keys=True)
+          temp_file.flush()
+          os.fsync(temp_file.fileno())
+        finally:
+          temp_file.close()
+        # Keep the permissions of the file being replaced.
+        if os.path.exists(self.path):
+          shutil.copymode(self.path, temp_path)
+        atomic_replace(temp_path, self.path)
+      except:
+        if os.path.exists(temp_path):
+          os.remove(temp_path)
+        raise
+
+      changed = data != self._data
+      self._file_key = self._get_file_key()
+      self._data = data
+      if changed:
+        self._notify_subscribers(data)
+
+  def update(self, **values):
+    """
+    Atomically updates the given keys in the config file and leaves all other
+    keys unchanged.
+    """
+    with self._lock:
+      data = dict(self.get())
+      data.update(values)
+      self.write(data)
+
+  def get_ngt_version(self):
+    """
+    Returns the NGT version recorded in the configuration.
+    """
+    return self.get()["ngt_version"]
+
+  def get_system_uuid(self):
+    """
+    Returns the system uuid recorded in the configuration or None.
+    """
+    return self.get_value("system_uuid")
+
+  def get_last_configuration_uuid(self):
+    """
+    Returns the uuid of the last applied guest VM configuration or None.
+    """
+    return self.get_value("last_configuration_uuid")
+
+  def get_configuration_uuid(self):
+    """
+    Returns the uuid of the guest VM configuration requested by this config or
+    None if it does not request any reconfiguration.
+    """
+    vm_configuration = self.get_value("modify_guest_vm_configuration") or {}
+    return vm_configuration.get("configuration_uuid")
+
+def get_config_store(path):
+  """
+  Returns the ConfigStore shared by all callers for the config file at 'path'.
+  """
+  path = os.path.abspath(path)
+  with _config_stores_lock:
+    if path not in _config_stores:
+      _config_stores[path] = ConfigStore(path)
+    return _config_stores[path]
+
+def _fsync_dir(dir_path):
+  """
+  Flushes the directory entry changes of 'dir_path' to disk.
+  """
+  dir_fd = os.open(dir_path, os.O_RDONLY)
+  try:
+    os.fsync(dir_fd)
+  finally:
+    os.close(dir_fd)
+
+def atomic_replace(src_path, dst_path):
+  """
+  Renames 'src_path' over 'dst_path' and makes the rename durable. Both paths
+  must be on the same file system.
+  """
+  os.rename(src_path, dst_path)
+  _fsync_dir(os.path.dirname(os.path.abspath(dst_path)))
+
+def atomic_copy(src_path, dst_dir):
+  """
+  Copies 'src_path' into the 'dst_dir' folder such that readers of the
+  destination file only ever see either the old or the new contents.
+  """
+  dst_path = os.path.join(dst_dir, os.path.basename(src_path))
+  fd, temp_path = tempfile.mkstemp(dir=dst_dir, prefix=".ngt_copy_")
+  try:
+    temp_file = os.fdopen(fd, "wb")
+    try:
+      with open(src_path, "rb") as src_file:
+        shutil.copyfileobj(src_file, temp_file)
+      temp_file.flush()
+      os.fsync(temp_file.fileno())
+    finally:
+      temp_file.close()
+    shutil.copymode(src_path, temp_path)
+    atomic_replace(temp_path, dst_path)
+  except:
+    if os.path.exists(temp_path):
+      os.remove(temp_path)
+    raise
+  return dst_path
@@ -13,6 +13,7 @@ import platform
 import sys
 
 from installer_utils import *
+from platform_probe import *
 
 def get_linux_installer():
   """
@@ -26,19 +27,17 @@ def get_linux_installer():
     exit_installer(1)
     return
 
-  distribution = platform.linux_distribution()[0].lower()
-  if ("centos" in distribution or
-      "oracle linux server" in distribution or
-      "red hat" in distribution):
+  platform_info = get_platform_info()
+  distribution = platform_info.name
+  if platform_info.family == FAMILY_REDHAT:
     # CentOS and Oracle Linux derive from the Red Hat Enterprise Linux
-    # and hence the same installer works for them. For Oracle Linux, the
-    # distribution string may the same as that for Red Hat in some cases.
+    # and hence the same installer works for them.
     from redhat_installer import RedhatInstaller as LinuxInstaller
 
-  elif "ubuntu" in distribution:
+  elif platform_info.family == FAMILY_UBUNTU:
     from ubuntu_installer import UbuntuInstaller as LinuxInstaller
 
-  elif "suse" in distribution:
+  elif platform_info.family == FAMILY_SUSE:
     from suse_installer import SuseInstaller as LinuxInstaller
 
   else:
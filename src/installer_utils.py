@@ -7,9 +7,115 @@
 # Nutanix Guest Agent Service modules.
 #
 
+import contextlib
+import json
 import logging
+import os
 import subprocess
 import sys
+import threading
+import time
+
+class InstallProfiler(object):
+  """
+  This class records the duration of the installer phases and of the shell
+  commands run within them. Phases may be nested.
+  """
+
+  def __init__(self):
+    self._lock = threading.Lock()
+    self.reset()
+
+  def reset(self):
+    """
+    Discards all recorded phases.
+    """
+    self._lock.acquire()
+    try:
+      self.start_time = time.time()
+      self.phases = []
+      self.commands = []
+      self._phase_stack = []
+    finally:
+      self._lock.release()
+
+  @contextlib.contextmanager
+  def phase(self, name):
+    """
+    Context manager that records the time spent in the phase 'name'. The phase
+    is marked as failed if an exception is raised from it.
+    """
+    phase = {"name": name, "start_secs": time.time() - self.start_time,
+             "duration_secs": None, "status": "running", "commands": [],
+             "phases": []}
+    self._lock.acquire()
+    try:
+      if self._phase_stack:
+        self._phase_stack[-1]["phases"].append(phase)
+      else:
+        self.phases.append(phase)
+      self._phase_stack.append(phase)
+    finally:
+      self._lock.release()
+
+    start_time = time.time()
+    try:
+      yield phase
+      phase["status"] = "success"
+    except:
+      phase["status"] = "failed"
+      raise
+    finally:
+      phase["duration_secs"] = time.time() - start_time
+      self._lock.acquire()
+      try:
+        self._phase_stack.remove(phase)
+      finally:
+        self._lock.release()
+
+  def record_command(self, argsList, duration_secs, returncode):
+    """
+    Records a shell command run in the current phase.
+    """
+    command = {"command": " ".join(argsList), "duration_secs": duration_secs,
+               "returncode": returncode}
+    self._lock.acquire()
+    try:
+      if self._phase_stack:
+        self._phase_stack[-1]["commands"].append(command)
+      else:
+        self.commands.append(command)
+    finally:
+      self._lock.release()
+
+  def report(self):
+    """
+    Returns the recorded phases and the commands run outside of any phase as
+    a json serializable dict.
+    """
+    return {"start_time": self.start_time,
+            "total_secs": time.time() - self.start_time,
+            "phases": self.phases,
+            "commands": self.commands}
+
+  def write_report(self, path):
+    """
+    Writes the json report of the recorded phases to 'path'.
+    """
+    with open(path, "w") as report_file:
+      json.dump(self.report(), report_file, indent=2)
+
+_install_profiler = InstallProfiler()
+
+def get_install_profiler():
+  """
+  Returns the InstallProfiler shared by all installer modules.
+  """
+  return _install_profiler
+
+# Interpreters the NGT Guest Agent daemon can run with, in order of preference.
+# This must be kept in sync with the lookup in the ngt_guest_agent init script.
+AGENT_PYTHON_PATHS = ["/usr/bin/python2.7", "/usr/bin/python2.6"]
 
 def run_shell_command(argsList):
   """
@@ -29,19 +135,34 @@ def run_shell_command(argsList):
     # Use this with Python 3 so subprocess output will be str, not bytes.
     kws['universal_newlines'] = True
 
+  start_time = time.time()
   try:
     p = subprocess.Popen(argsList, **kws)
     (output, err) = p.communicate()
 
   except Exception as exc:
+    _install_profiler.record_command(argsList, time.time() - start_time, None)
     raise exc
 
+  _install_profiler.record_command(argsList, time.time() - start_time,
+                                   p.returncode)
+
   if p.returncode != 0:
     raise Exception("%s failed, Status code:%s, Output:%r, Error:%r"
       % (command, p.returncode, output, err))
 
   return output
 
+def get_agent_python():
+  """
+  Returns the path of the python interpreter that will be used to run the
+  NGT Guest Agent daemon or None if no supported interpreter is found.
+  """
+  for python_path in AGENT_PYTHON_PATHS:
+    if os.path.exists(python_path):
+      return python_path
+  return None
+
 def exit_installer(status):
   logging.shutdown()
   sys.exit(status)
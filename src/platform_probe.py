@@ -0,0 +1,154 @@
+#
+# Copyright (c) 2016 Nutanix Inc. All rights reserved.
+#
+# This module identifies the Linux distribution, kernel and architecture of
+# the VM. The release files are only read once per process and the result is
+# shared by all callers.
+#
+
+import collections
+import os
+import re
+
+OS_RELEASE_PATH = "/etc/os-release"
+REDHAT_RELEASE_PATH = "/etc/redhat-release"
+SUSE_RELEASE_PATH = "/etc/SuSE-release"
+LSB_RELEASE_PATH = "/etc/lsb-release"
+
+# Distribution families supported by NGT.
+FAMILY_REDHAT = "redhat"
+FAMILY_SUSE = "suse"
+FAMILY_UBUNTU = "ubuntu"
+
+# os-release IDs of the distributions in each family.
+_FAMILY_IDS = {
+  "rhel": FAMILY_REDHAT,
+  "centos": FAMILY_REDHAT,
+  "ol": FAMILY_REDHAT,
+  "sles": FAMILY_SUSE,
+  "sled": FAMILY_SUSE,
+  "opensuse": FAMILY_SUSE,
+  "ubuntu": FAMILY_UBUNTU,
+}
+
+# Substrings of distribution names in each family, used when os-release is
+# not available.
+_FAMILY_NAMES = [
+  ("centos", FAMILY_REDHAT),
+  ("red hat", FAMILY_REDHAT),
+  ("oracle linux server", FAMILY_REDHAT),
+  ("suse", FAMILY_SUSE),
+  ("ubuntu", FAMILY_UBUNTU),
+]
+
+# Immutable description of the platform.
+#  name: Lower case distribution name, e.g. "centos linux".
+#  family: One of the FAMILY_* constants or None if not supported.
+#  version: Distribution version string, e.g. "7.3".
+#  version_tuple: Numeric components of the version, e.g. (7, 3).
+#  kernel: Release of the running kernel, e.g. "3.10.0-514.el7.x86_64".
+#  machine: Hardware architecture, e.g. "x86_64".
+PlatformInfo = collections.namedtuple(
+  "PlatformInfo",
+  ["name", "family", "version", "version_tuple", "kernel", "machine"])
+
+_platform_info = None
+
+def _read_key_value_file(path):
+  """
+  Parses a file with KEY=value lines such as os-release and returns a dict.
+  Quotes around the values are removed.
+  """
+  values = {}
+  with open(path) as data_file:
+    for line in data_file:
+      line = line.strip()
+      if not line or line.startswith("#") or "=" not in line:
+        continue
+      key, value = line.split("=", 1)
+      value = value.strip()
+      if len(value) >= 2 and value[0] == value[-1] and value[0] in "\"'":
+        value = value[1:-1]
+      values[key.strip()] = value
+  return values
+
+def _get_family(dist_id, id_like, name):
+  """
+  Returns the distribution family from the os-release ID and ID_LIKE values
+  or, if those are not known, from the distribution name.
+  """
+  if dist_id:
+    if dist_id in _FAMILY_IDS:
+      return _FAMILY_IDS[dist_id]
+    if dist_id.startswith("opensuse") or "suse" in id_like.split():
+      return FAMILY_SUSE
+  for name_part, family in _FAMILY_NAMES:
+    if name_part in name:
+      return family
+  return None
+
+def _get_version_tuple(version):
+  """
+  Returns the leading numeric components of a version string as a tuple.
+  """
+  match = re.match(r"\d+(\.\d+)*", version)
+  if not match:
+    return ()
+  return tuple([int(part) for part in match.group(0).split(".")])
+
+def _read_distribution():
+  """
+  Returns the (name, id, id_like, version) of the distribution. os-release is
+  preferred and the distribution specific release files are used on older
+  releases that do not provide it.
+  """
+  if os.path.exists(OS_RELEASE_PATH):
+    values = _read_key_value_file(OS_RELEASE_PATH)
+    return (values.get("NAME", ""), values.get("ID", ""),
+            values.get("ID_LIKE", ""), values.get("VERSION_ID", ""))
+
+  if os.path.exists(REDHAT_RELEASE_PATH):
+    with open(REDHAT_RELEASE_PATH) as data_file:
+      line = data_file.readline().strip()
+    # For example "CentOS release 6.7 (Final)".
+    match = re.match(r"(.*?)\s+release\s+([\d.]+)", line)
+    if match:
+      return (match.group(1), "", "", match.group(2))
+    return (line, "", "", "")
+
+  if os.path.exists(SUSE_RELEASE_PATH):
+    with open(SUSE_RELEASE_PATH) as data_file:
+      name = data_file.readline().strip()
+    values = _read_key_value_file(SUSE_RELEASE_PATH)
+    version = values.get("VERSION", "")
+    if version and values.get("PATCHLEVEL"):
+      version = version + "." + values["PATCHLEVEL"]
+    # Drop the architecture, e.g. "SUSE Linux Enterprise Server 11 (x86_64)".
+    name = re.sub(r"\s*\d*\s*\(.*\)$", "", name)
+    return (name, "", "", version)
+
+  if os.path.exists(LSB_RELEASE_PATH):
+    values = _read_key_value_file(LSB_RELEASE_PATH)
+    return (values.get("DISTRIB_ID", ""), "", "",
+            values.get("DISTRIB_RELEASE", ""))
+
+  return ("", "", "", "")
+
+def get_platform_info():
+  """
+  Returns the PlatformInfo for this VM. The release files are only read on
+  the first call.
+  """
+  global _platform_info
+  if _platform_info is None:
+    name, dist_id, id_like, version = _read_distribution()
+    name = name.lower()
+    uname = os.uname()
+    _platform_info = PlatformInfo(
+      name=name,
+      family=_get_family(dist_id.lower(), id_like.lower(), name),
+      version=version,
+      version_tuple=_get_version_tuple(version),
+      kernel=uname[2],
+      machine=uname[4])
+  return _platform_info
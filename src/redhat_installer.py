@@ -9,14 +9,22 @@
 #
 
 import os
-import platform
 import re
 import shutil
 import tempfile
+import threading
+import time
+
+try:
+  import Queue as queue
+except ImportError:
+  import queue
 
 from distutils.version import LooseVersion
 
+from config_store import get_config_store
 from installer_utils import *
+from platform_probe import get_platform_info
 from base_installer import *
 
 class RedhatInstaller(LinuxInstaller):
@@ -26,6 +34,29 @@ class RedhatInstaller(LinuxInstaller):
   NGT_DRACUT_PATH = "/etc/dracut.conf"
   REDHAT_MIN_VERSION = "6.4"
 
+  # virtio_scsi, virtio_net, virtio_blk, virtio_pci are required for AHV,
+  # vmw_pvscsi, vmxnet3, e1000, mptsas, mptspi are required for ESX.
+  MOBILITY_DRIVERS = ["virtio_scsi", "virtio_net", "virtio_blk", "virtio_pci",
+                      "vmw_pvscsi", "vmxnet3", "e1000", "mptsas", "mptspi"]
+
+  # Locations of the installed kernels and their initramfs images.
+  KERNEL_MODULES_DIR = "/lib/modules"
+  BOOT_DIR = "/boot"
+
+  # Maximum number of initramfs images rebuilt concurrently.
+  MAX_DRACUT_WORKERS = 2
+
+  # Status of the mobility drivers in each initramfs image, reported in VmInfo.
+  NGT_MOBILITY_DRIVERS_STATUS_PATH = LinuxInstaller.NGT_CONFIG + \
+    "/mobility_drivers_status.json"
+
+  def __init__(self):
+    # Kernels whose initramfs images still need to be rebuilt.
+    self.pending_initramfs_kernels = []
+    # Status of each kernel's initramfs image, keyed by kernel release.
+    self.initramfs_status = {}
+    self.initramfs_status_lock = threading.Lock()
+
   def do_validate(self):
     """
     This function ensures that pre-conditions required for a successful execution
@@ -34,7 +65,7 @@ class RedhatInstaller(LinuxInstaller):
     if not super(RedhatInstaller, self).do_validate():
       return False
 
-    version = platform.linux_distribution()[1]
+    version = get_platform_info().version
 
     if LooseVersion(version) < LooseVersion(self.REDHAT_MIN_VERSION):
       logging.error("Version %s is not supported. MinVersion %s." \
@@ -118,20 +149,19 @@ class RedhatInstaller(LinuxInstaller):
     temp_fd, temp_path = tempfile.mkstemp()
     temp_file = open(temp_path, 'w')
 
-    # virtio_scsi, virtio_net, virtio_blk, virtio_pci are required for AHV,
-    # vmw_pvscsi, vmxnet3, e1000, mptsas, mptspi are required for ESX.
-    drivers = ["virtio_scsi", "virtio_net", "virtio_blk", "virtio_pci",
-               "vmw_pvscsi", "vmxnet3", "e1000", "mptsas", "mptspi"]
+    drivers = self.MOBILITY_DRIVERS
+    found_add_drivers = False
     with open(self.NGT_DRACUT_PATH, 'r') as file:
       data = file.readlines()
       for line in data:
         match = re.match(r'#?add_drivers\+\="(.*)"', line)
         if match:
+          found_add_drivers = True
           modified = False
           current_drivers = match.group(1)
           # Add the drivers needed for ESX and AHV if not already present.
           for driver in drivers:
-            if (not driver in current_drivers) and \
+            if (not driver in current_drivers.split()) and \
                self.is_kernel_module_present(driver):
               current_drivers = current_drivers + " " + driver
               modified = True
@@ -146,6 +176,16 @@ class RedhatInstaller(LinuxInstaller):
         else:
           temp_file.write(line)
 
+    # Some dracut.conf files, e.g. when the settings are kept in dracut.conf.d,
+    # have no add_drivers line to update. Add one with the available drivers.
+    if not found_add_drivers:
+      present_drivers = [driver for driver in drivers
+                         if self.is_kernel_module_present(driver)]
+      if present_drivers:
+        if data and not data[-1].endswith('\n'):
+          temp_file.write('\n')
+        temp_file.write('add_drivers+=\" %s \"\n' % " ".join(present_drivers))
+
     temp_file.close()
     os.close(temp_fd)
 
@@ -153,22 +193,261 @@ class RedhatInstaller(LinuxInstaller):
     shutil.copy2(temp_path, self.NGT_DRACUT_PATH)
     os.remove(temp_path)
 
+  def get_configured_dracut_drivers(self):
+    """
+    Returns the mobility drivers that dracut.conf asks dracut to add to the
+    initramfs.
+    """
+    configured_drivers = []
+    with open(self.NGT_DRACUT_PATH, 'r') as file:
+      for line in file:
+        match = re.match(r'add_drivers\+\="(.*)"', line.strip())
+        if match:
+          configured_drivers.extend(match.group(1).split())
+    return [driver for driver in self.MOBILITY_DRIVERS
+            if driver in configured_drivers]
+
+  def get_installed_kernels(self):
+    """
+    Returns the releases of the installed kernels. The running kernel is
+    always included.
+    """
+    running_kernel = get_platform_info().kernel
+    kernels = [running_kernel]
+    if os.path.isdir(self.KERNEL_MODULES_DIR):
+      for kernel in sorted(os.listdir(self.KERNEL_MODULES_DIR)):
+        if kernel != running_kernel and \
+           os.path.exists(self.BOOT_DIR + "/vmlinuz-" + kernel):
+          kernels.append(kernel)
+    return kernels
+
+  def get_initramfs_path(self, kernel):
+    """
+    Returns the path of the initramfs image for the given kernel release.
+    """
+    return self.BOOT_DIR + "/initramfs-" + kernel + ".img"
+
+  def get_kernel_module_file(self, kernel, module_name):
+    """
+    Returns the file name of the kernel module for the given kernel release,
+    "(builtin)" if the module is built into the kernel or None if the module
+    is not available for that kernel.
+    """
+    try:
+      output = run_shell_command(["/sbin/modinfo", "-k", kernel,
+                                  "-F", "filename", module_name])
+    except:
+      return None
+    output = output.strip()
+    if not output:
+      return None
+    return os.path.basename(output.splitlines()[0])
+
+  def get_missing_initramfs_drivers(self, kernel, assume_missing=True):
+    """
+    Returns the mobility drivers that dracut.conf adds and that are available
+    for the given kernel release, but are missing from its initramfs image. If
+    the contents of the image cannot be listed, all of these drivers are
+    returned when 'assume_missing' is set and none otherwise.
+    """
+    required_modules = []
+    for driver in self.get_configured_dracut_drivers():
+      module_file = self.get_kernel_module_file(kernel, driver)
+      if module_file and module_file != "(builtin)":
+        # Strip any compression suffix, e.g. "virtio_net.ko.xz".
+        module_file = module_file[:module_file.index(".ko") + 3]
+        required_modules.append((driver, module_file))
+
+    initramfs_path = self.get_initramfs_path(kernel)
+    contents = None
+    if os.path.exists(initramfs_path):
+      try:
+        contents = run_shell_command(["lsinitrd", initramfs_path])
+      except:
+        logging.warning("Unable to list the contents of %s." % initramfs_path)
+
+    if contents is None and not assume_missing:
+      logging.warning("Unable to verify the VM mobility drivers in %s."
+        % initramfs_path)
+      return []
+
+    missing_drivers = []
+    for driver, module_file in required_modules:
+      if contents is None or ("/" + module_file) not in contents:
+        missing_drivers.append(driver)
+    return missing_drivers
+
+  def _set_initramfs_status(self, kernel, state, missing_drivers=None):
+    """
+    Records the state of the initramfs image of 'kernel' and persists the
+    status of all images for VmInfo.
+    """
+    self.initramfs_status_lock.acquire()
+    try:
+      self.initramfs_status[kernel] = {
+        "initramfs": self.get_initramfs_path(kernel),
+        "state": state,
+        "missing_drivers": missing_drivers or [],
+        "timestamp": int(time.time())
+      }
+      get_config_store(self.NGT_MOBILITY_DRIVERS_STATUS_PATH).write(
+        {"kernels": dict(self.initramfs_status)})
+    except Exception as e:
+      logging.warning("Failed to record mobility drivers status : %s" % e)
+    finally:
+      self.initramfs_status_lock.release()
+
+  def rebuild_initramfs(self, kernel):
+    """
+    Regenerates the initramfs image of the given kernel release with dracut.
+    Returns False if dracut fails. An image that dracut built but that is
+    still missing drivers is recorded as failed without failing the rebuild.
+    """
+    initramfs_path = self.get_initramfs_path(kernel)
+    logging.info("Rebuilding %s with VM mobility drivers." % initramfs_path)
+    try:
+      run_shell_command(["dracut", "-f", initramfs_path, kernel])
+    except Exception as e:
+      logging.error("Failed to rebuild %s : %s" % (initramfs_path, e))
+      self._set_initramfs_status(kernel, "failed")
+      return False
+
+    # Check that dracut actually included the drivers in the new image.
+    missing_drivers = self.get_missing_initramfs_drivers(kernel,
+                                                         assume_missing=False)
+    # dracut itself succeeded, so this is reported but does not fail the
+    # install.
+    if missing_drivers:
+      logging.warning("Rebuilt %s is still missing drivers : %s"
+        % (initramfs_path, " ".join(missing_drivers)))
+      self._set_initramfs_status(kernel, "failed", missing_drivers)
+      return True
+    self._set_initramfs_status(kernel, "rebuilt")
+    return True
+
+  def rebuild_initramfs_images(self, kernels):
+    """
+    Rebuilds the initramfs images of the given kernel releases using at most
+    MAX_DRACUT_WORKERS concurrent dracut runs. Returns the list of kernels
+    whose images could not be rebuilt.
+    """
+    pending = queue.Queue()
+    for kernel in kernels:
+      pending.put(kernel)
+    failed_kernels = []
+    failed_kernels_lock = threading.Lock()
+
+    def rebuild_worker():
+      while True:
+        try:
+          kernel = pending.get_nowait()
+        except queue.Empty:
+          return
+        if not self.rebuild_initramfs(kernel):
+          failed_kernels_lock.acquire()
+          try:
+            failed_kernels.append(kernel)
+          finally:
+            failed_kernels_lock.release()
+
+    workers = []
+    for _ in range(min(len(kernels), self.MAX_DRACUT_WORKERS)):
+      worker = threading.Thread(target=rebuild_worker)
+      worker.start()
+      workers.append(worker)
+    for worker in workers:
+      worker.join()
+    return failed_kernels
+
   def setup_mobility_drivers(self):
     """
-    This function loads the VirtIO and mptsas drivers into the initramfs file
-    for the current OS kernel.
+    This function loads the VirtIO and mptsas drivers into the initramfs files
+    of the installed kernels. Only the images that are missing drivers are
+    rebuilt. If driver setup is deferred, the rebuild is left to
+    do_deferred_setup().
     """
     logging.info("Setting up Nutanix Guest Tools - VM mobility drivers.")
 
     self.update_dracut_conf()
 
-    # Run dracut to update the initramfs file based on the updated config.
-    try:
-      run_shell_command(["dracut", "-f"])
-    except:
+    self.pending_initramfs_kernels = []
+    for kernel in self.get_installed_kernels():
+      missing_drivers = self.get_missing_initramfs_drivers(kernel)
+      if missing_drivers:
+        logging.info("Initramfs for kernel %s is missing drivers : %s"
+          % (kernel, " ".join(missing_drivers)))
+        self.pending_initramfs_kernels.append(kernel)
+        self._set_initramfs_status(kernel, "pending", missing_drivers)
+      else:
+        self._set_initramfs_status(kernel, "up_to_date")
+
+    if not self.pending_initramfs_kernels:
+      logging.info("VM mobility drivers are already present in the " \
+        "initramfs of all installed kernels.")
+      return
+
+    if self.defer_driver_setup:
+      logging.info("Deferring the rebuild of the initramfs for kernels : %s"
+        % " ".join(self.pending_initramfs_kernels))
+      return
+
+    # Run dracut to update the initramfs files based on the updated config.
+    failed_kernels = self.rebuild_initramfs_images(
+      self.pending_initramfs_kernels)
+    self.pending_initramfs_kernels = []
+    if get_platform_info().kernel in failed_kernels:
       logging.error("Failed to setup Nutanix Guest Tools - VM mobility " \
         "drivers.")
-      raise
+      raise Exception("Failed to rebuild initramfs for the running kernel.")
+    if failed_kernels:
+      logging.warning("VM mobility drivers are not set up for kernels : %s"
+        % " ".join(failed_kernels))
 
     logging.info("Successfully set up Nutanix Guest Tools - VM mobility " \
       "drivers.")
+
+  def do_deferred_setup(self):
+    """
+    This function rebuilds the initramfs images left pending by a deferred
+    driver setup in a background process, so that the installer returns as
+    soon as the NGT Guest Agent is running.
+    """
+    if not self.pending_initramfs_kernels:
+      return
+
+    pid = os.fork()
+    if pid != 0:
+      logging.info("Rebuilding initramfs in background process %d." % pid)
+      self.pending_initramfs_kernels = []
+      return
+
+    # Detach the background process from the installer session and its
+    # terminal so that callers waiting on the installer output are not held
+    # up by the rebuild. Only the install log file keeps being written.
+    os.setsid()
+    devnull_fd = os.open(os.devnull, os.O_RDWR)
+    for fd in range(3):
+      os.dup2(devnull_fd, fd)
+    if devnull_fd > 2:
+      os.close(devnull_fd)
+    logger = logging.getLogger()
+    for handler in list(logger.handlers):
+      if not isinstance(handler, logging.FileHandler):
+        logger.removeHandler(handler)
+    exit_status = 0
+    try:
+      failed_kernels = self.rebuild_initramfs_images(
+        self.pending_initramfs_kernels)
+      if failed_kernels:
+        logging.error("VM mobility drivers are not set up for kernels : %s"
+          % " ".join(failed_kernels))
+        exit_status = 1
+      else:
+        logging.info("Successfully set up Nutanix Guest Tools - VM " \
+          "mobility drivers.")
+    except Exception as e:
+      logging.error("Failed to setup Nutanix Guest Tools - VM mobility " \
+        "drivers : %s" % e)
+      exit_status = 1
+    logging.shutdown()
+    os._exit(exit_status)
@@ -9,11 +9,11 @@
 #
 
 import os
-import platform
 
 from distutils.version import LooseVersion
 
 from installer_utils import *
+from platform_probe import get_platform_info
 from base_installer import *
 
 class SuseInstaller(LinuxInstaller):
@@ -30,7 +30,7 @@ class SuseInstaller(LinuxInstaller):
     if not super(SuseInstaller, self).do_validate():
       return False
 
-    version = platform.linux_distribution()[1]
+    version = get_platform_info().version
 
     if LooseVersion(version) < LooseVersion(self.SUSE_MIN_VERSION):
       logging.error("Version %s is not supported. MinVersion %s." \
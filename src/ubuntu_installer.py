@@ -8,11 +8,11 @@
 #
 
 import os
-import platform
 
 from distutils.version import LooseVersion
 
 from installer_utils import *
+from platform_probe import get_platform_info
 from base_installer import *
 
 class UbuntuInstaller(LinuxInstaller):
@@ -29,7 +29,7 @@ class UbuntuInstaller(LinuxInstaller):
     if not super(UbuntuInstaller, self).do_validate():
       return False
 
-    version = platform.linux_distribution()[1]
+    version = get_platform_info().version
 
     if LooseVersion(version) < LooseVersion(self.UBUNTU_MIN_VERSION):
       logging.error("Ubuntu Version %s is not supported. MinVersion %s."\
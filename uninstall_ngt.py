@@ -10,7 +10,6 @@
 import datetime
 import logging
 import os
-import platform
 import shutil
 import subprocess
 import sys
@@ -19,12 +18,15 @@ import sys
 NGT_ROOT = "/usr/local/nutanix"
 NGT_DAEMON_NAME = "ngt_guest_agent"
 NGT_DST_DAEMON_PATH = "/etc/init.d/" + NGT_DAEMON_NAME
+NGT_SYSTEMD_UNIT_NAME = NGT_DAEMON_NAME + ".service"
+NGT_DST_SYSTEMD_UNIT_PATH = "/etc/systemd/system/" + NGT_SYSTEMD_UNIT_NAME
 
 src_path = os.path.abspath(
   os.path.join(NGT_ROOT, "bin"))
 sys.path.insert(0, src_path)
 
 from installer_utils import *
+from platform_probe import *
 
 def run_shell_command(argsList):
   """
@@ -67,6 +69,35 @@ def confirm_uninstall():
     if ans == 'n' or ans == 'N':
       return False
 
+def uninstall_ngt_systemd_service():
+  """
+  This function stops & removes the NGT Guest Agent systemd service.
+  """
+  # Only attempt uninstall if the service was installed.
+  if not os.path.exists(NGT_DST_SYSTEMD_UNIT_PATH):
+    return
+
+  logging.info("Stopping and removing Nutanix Guest Agent Service.")
+
+  # Stop the service if currently running.
+  try:
+    run_shell_command(["systemctl", "stop", NGT_SYSTEMD_UNIT_NAME])
+  except:
+    pass
+
+  # Turn the autostart on boot to off.
+  try:
+    run_shell_command(["systemctl", "disable", NGT_SYSTEMD_UNIT_NAME])
+  except:
+    pass
+
+  # Remove the service unit and let systemd forget about it.
+  os.remove(NGT_DST_SYSTEMD_UNIT_PATH)
+  try:
+    run_shell_command(["systemctl", "daemon-reload"])
+  except:
+    pass
+
 def uninstall_ngt_daemon_redhat():
   """
   This function stops & removes the NGT Guest Agent daemon from Red Hat
@@ -148,15 +179,17 @@ if __name__ == "__main__":
 
 # Uninstall the NGT Guest Agent daemon if installed.
   try:
-    distribution = platform.linux_distribution()[0].lower()
+    uninstall_ngt_systemd_service()
+  except:
+    pass
+
+  try:
+    family = get_platform_info().family
 
-    if ("centos" in distribution or
-        "red hat" in distribution or
-        "oracle linux server" in distribution or
-        "suse" in distribution):
+    if family in (FAMILY_REDHAT, FAMILY_SUSE):
       uninstall_ngt_daemon_redhat()
 
-    elif "ubuntu" in distribution:
+    elif family == FAMILY_UBUNTU:
       uninstall_ngt_daemon_ubuntu()
 
     else: